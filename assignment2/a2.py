@@ -2,11 +2,510 @@
 # Implement the specified commands to complete the assignment
 # Full assignment specification on Canvas
 
+import os
 import sys
-import signal
+import json
+import io
+import asyncio
+import contextlib
+import concurrent.futures
+import copy
+import threading
+import struct
+import mmap
+import multiprocessing
+import queue
+from array import array
+from itertools import combinations
+from math import comb
+import math
 import random
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Points for a line of each length: 2^(L-1) for lines longer than one piece
+LINE_VALUE = [0, 0] + [2 ** (length-1) for length in range(2, 22)]
+
+# Neighbouring cells in all eight directions
+NEIGHBOURS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+# Transposition table bound types
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Depth stored for proven wins/losses, which hold at any search depth
+PROVEN_DEPTH = 1000
+
+# Book of proven results loaded at startup
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "a2_book.bin")
+
+# Where tablebase files are written and looked for
+TABLEBASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Largest tablebase the tablebase command will build, in positions
+TABLEBASE_LIMIT = 20000000
+
+# Half-width in points of the root aspiration window
+ASPIRATION_WINDOW = 4
+
+# Target seconds between clock reads during a search
+CHECK_PERIOD = 0.01
+
+class SearchTimeout(TimeoutError):
+    """Raised from inside the search once the time limit has passed"""
+    pass
+
+class Deadline:
+    """When a search has to stop: a budget in seconds, fractions allowed, or an earlier cancel().
+    It only reads a clock, so unlike an alarm signal it works in any thread."""
+    def __init__(self, seconds):
+        self.end = time.monotonic() + seconds
+        self.cancelled = False
+
+    def remaining(self):
+        return self.end - time.monotonic()
+
+    def expired(self):
+        return self.cancelled or time.monotonic() >= self.end
+
+    def cancel(self):
+        self.cancelled = True
+
+# Entries kept in the proof-number search table before it is reset
+PN_TABLE_LIMIT = 1000000
+
+# Exploration constant of the UCT formula used by Monte Carlo tree search
+UCT_EXPLORATION = 1.4
+
+class BitBoard:
+    """One integer bitmask per player, bit y*stride + x for cell (x, y).
+    Every row has a spare guard bit so shifted masks never wrap onto the next row."""
+    def __init__(self, width, height, board):
+        self.width = width
+        self.height = height
+        self.stride = width + 1
+        row = (1 << width) - 1
+        self.full = 0
+        for y in range(height):
+            self.full |= row << (y * self.stride)
+        # Horizontal, vertical, diagonal, anti-diagonal
+        self.shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+        self.masks = [0, 0, 0]
+        for y in range(height):
+            for x in range(width):
+                if board[y][x] != 0:
+                    self.masks[board[y][x]] |= self.bit(x, y)
+
+    def bit(self, x, y):
+        return 1 << (y * self.stride + x)
+
+    def empty(self):
+        return self.full & ~(self.masks[1] | self.masks[2])
+
+    def cells(self, mask):
+        # (x, y) of every set bit in row-major order
+        cells = []
+        while mask:
+            low = mask & -mask
+            i = low.bit_length() - 1
+            cells.append((i % self.stride, i // self.stride))
+            mask ^= low
+        return cells
+
+    def line_score(self, mask):
+        """Same score as CommandInterface.full_score, for the pieces in mask"""
+        score = 0
+        neighbours = 0
+        for d in self.shifts:
+            neighbours |= (mask << d) | (mask >> d)
+            # Starts of lines of length >= 2, extended one step at a time
+            run = mask & ~(mask << d) & (mask >> d)
+            length = 2
+            while run:
+                score += (LINE_VALUE[length] - LINE_VALUE[length-1]) * run.bit_count()
+                run &= mask >> (length * d)
+                length += 1
+        # Lone pieces have no neighbour of the same colour in any direction
+        return score + (mask & ~neighbours).bit_count()
+
+def shift_forward(a, dx, dy):
+    """a moved one step along (dx, dy) inside its zero border"""
+    out = np.zeros_like(a)
+    h, w = a.shape[1], a.shape[2]
+    out[:, 1:-1, 1:-1] = a[:, 1-dy:h-1-dy, 1-dx:w-1-dx]
+    return out
+
+def batch_scores(boards, handicap):
+    """Both players' scores for every board in an (N, h, w) array, as in CommandInterface.full_score.
+    Falls back to scoring one board at a time when NumPy is not installed."""
+    if np is None:
+        scores = ([], [])
+        for board in boards:
+            bits = BitBoard(len(board[0]), len(board), board)
+            scores[0].append(bits.line_score(bits.masks[1]))
+            scores[1].append(handicap + bits.line_score(bits.masks[2]))
+        return scores
+    boards = np.asarray(boards, dtype=np.int8)
+    padded = np.pad(boards, ((0, 0), (1, 1), (1, 1)))
+    scores = []
+    for player in (1, 2):
+        mask = padded == player
+        score = np.zeros(len(boards), dtype=np.int64)
+        neighbours = np.zeros_like(mask)
+        for dx, dy in ((1, 0), (0, 1), (1, 1), (-1, 1)):
+            forward = shift_forward(mask, dx, dy)
+            neighbours |= forward | shift_forward(mask, -dx, -dy)
+            # Cells at position length-1 of lines at least length long
+            run = mask & ~forward
+            length = 2
+            while True:
+                run = shift_forward(run, dx, dy) & mask
+                counts = run.sum(axis=(1, 2))
+                if not counts.any():
+                    break
+                score += (LINE_VALUE[length] - LINE_VALUE[length-1]) * counts
+                length += 1
+        score += (mask & ~neighbours).sum(axis=(1, 2))
+        scores.append(score)
+    return scores[0], scores[1] + handicap
+
+def symmetries(width, height):
+    """Coordinate maps that leave the scoring rules unchanged: 8 on square boards, 4 otherwise"""
+    w = width - 1
+    h = height - 1
+    maps = [lambda x, y: (x, y), lambda x, y: (w-x, y), lambda x, y: (x, h-y), lambda x, y: (w-x, h-y)]
+    if width == height:
+        maps += [lambda x, y: (y, x), lambda x, y: (w-y, x), lambda x, y: (y, h-x), lambda x, y: (w-y, h-x)]
+    # tables[s][y][x] is the image of (x, y) under symmetry s
+    tables = [[[m(x, y) for x in range(width)] for y in range(height)] for m in maps]
+    cells = [(x, y) for y in range(height) for x in range(width)]
+    inverse = []
+    for s in tables:
+        for t, u in enumerate(tables):
+            if all(u[s[y][x][1]][s[y][x][0]] == (x, y) for x, y in cells):
+                inverse.append(t)
+                break
+    return tables, inverse
+
+class TranspositionTable:
+    """Fixed-size transposition table stored in flat preallocated arrays.
+    Each bucket has a depth-preferred slot and an always-replace slot."""
+    # key, value, depth, flag, move, generation
+    ENTRY_BYTES = 8 + 8 + 2 + 1 + 2 + 1
+
+    def __init__(self, megabytes):
+        slots = max(2, int(megabytes * 2 ** 20) // self.ENTRY_BYTES)
+        buckets = 1
+        while buckets * 4 <= slots:
+            buckets *= 2
+        self.mask = buckets - 1
+        self.size = buckets * 2
+        self.megabytes = megabytes
+        self.clear()
+
+    def clear(self):
+        n = self.size
+        self.keys = array("Q", bytes(8 * n))
+        self.values = array("d", bytes(8 * n))
+        self.depths = array("h", [-1]) * n
+        self.flags = array("b", bytes(n))
+        self.moves = array("h", [-1]) * n
+        self.generations = array("B", bytes(n))
+        self.generation = 0
+
+    def new_search(self):
+        # Entries from older searches may be replaced regardless of depth
+        self.generation = (self.generation + 1) & 0xFF
+
+    def get(self, key):
+        i = (key & self.mask) << 1
+        if self.keys[i] != key or self.depths[i] < 0:
+            i += 1
+            if self.keys[i] != key or self.depths[i] < 0:
+                return None
+        move = self.moves[i]
+        return self.depths[i], self.flags[i], self.values[i], None if move < 0 else (move & 31, move >> 5)
+
+    def store(self, key, depth, flag, value, move):
+        i = (key & self.mask) << 1
+        if self.keys[i] != key and self.depths[i] >= 0 and self.depths[i] > depth \
+                and self.generations[i] == self.generation:
+            # Keep the deeper entry, overwrite the always-replace slot instead
+            i += 1
+        self.keys[i] = key
+        self.values[i] = value
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = -1 if move is None else move[0] | (move[1] << 5)
+        self.generations[i] = self.generation
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in an anonymous shared mapping, so processes forked
+    from the owner read and write the same entries. A lock keeps entries whole."""
+    def clear(self):
+        n = self.size
+        self.memory = mmap.mmap(-1, self.ENTRY_BYTES * n)
+        view = memoryview(self.memory)
+        offset = 0
+        for name, code, width in (("keys", "Q", 8), ("values", "d", 8), ("depths", "h", 2),
+                                  ("moves", "h", 2), ("flags", "b", 1), ("generations", "B", 1)):
+            setattr(self, name, view[offset:offset + width * n].cast(code))
+            offset += width * n
+        self.depths[:] = array("h", [-1]) * n
+        self.moves[:] = array("h", [-1]) * n
+        self.generation = 0
+        self.lock = multiprocessing.get_context("fork").Lock()
+
+    def get(self, key):
+        with self.lock:
+            return TranspositionTable.get(self, key)
+
+    def store(self, key, depth, flag, value, move):
+        with self.lock:
+            TranspositionTable.store(self, key, depth, flag, value, move)
+
+class MCTSNode:
+    """A position in the Monte Carlo search tree. wins counts playouts won by player,
+    the player who made move to reach it."""
+    __slots__ = ("move", "player", "parent", "children", "untried", "winner", "visits", "wins")
+
+    def __init__(self, move, player, parent):
+        self.move = move
+        self.player = player
+        self.parent = parent
+        self.children = []
+        # Filled in the first time the node is reached
+        self.untried = None
+        self.winner = 0
+        self.visits = 0
+        self.wins = 0
+
+    def select(self):
+        """Child with the highest UCT value"""
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda child: child.wins / child.visits
+                   + UCT_EXPLORATION * math.sqrt(log_visits / child.visits))
+
+class PositionBook:
+    """Proven solve results on disk: an open-addressing table of (key, result) slots,
+    memory-mapped read-only. New results are kept in memory until flush writes them."""
+    MAGIC = b"A2BK"
+    HEADER = struct.Struct("<4sII")
+    SLOT = struct.Struct("<QQ")
+
+    def __init__(self, path):
+        self.path = path
+        self.new = {}
+        self.memory = None
+        self.slots = 0
+        self.open()
+
+    def open(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory = None
+            self.slots = 0
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self.HEADER.size:
+            return
+        with open(self.path, "rb") as f:
+            memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slots = self.HEADER.unpack_from(memory, 0)
+        if magic != self.MAGIC or version != 1 or len(memory) < self.HEADER.size + slots * self.SLOT.size:
+            print("Ignoring invalid book file", self.path, file=sys.stderr)
+            memory.close()
+            return
+        self.memory = memory
+        self.slots = slots
+
+    @staticmethod
+    def encode(winner, move, depth):
+        # winner in bits 0-1, move flag in bit 2, x and y in bits 3-12, proof depth above
+        data = winner | (depth << 13)
+        if move is not None:
+            data |= 4 | (move[0] << 3) | (move[1] << 8)
+        return data
+
+    @staticmethod
+    def decode(data):
+        move = ((data >> 3) & 31, (data >> 8) & 31) if data & 4 else None
+        return data & 3, move, data >> 13
+
+    def stored(self):
+        # (key, data) of every occupied slot in the file
+        for i in range(self.slots):
+            key, data = self.SLOT.unpack_from(self.memory, self.HEADER.size + i * self.SLOT.size)
+            if data != 0:
+                yield key, data
+
+    def lookup(self, key):
+        """(winner, move, proof depth) for key, or None"""
+        if key in self.new:
+            return self.decode(self.new[key])
+        if self.memory is None:
+            return None
+        mask = self.slots - 1
+        i = key & mask
+        while True:
+            slot_key, data = self.SLOT.unpack_from(self.memory, self.HEADER.size + i * self.SLOT.size)
+            if data == 0:
+                return None
+            if slot_key == key:
+                return self.decode(data)
+            i = (i + 1) & mask
+
+    def add(self, key, winner, move, depth):
+        self.new[key] = self.encode(winner, move, depth)
+
+    def flush(self):
+        """Merge new results into the file and map it again"""
+        entries = dict(self.stored()) if self.memory is not None else {}
+        entries.update(self.new)
+        slots = 1
+        while slots < 2 * len(entries):
+            slots *= 2
+        table = bytearray(self.HEADER.size + slots * self.SLOT.size)
+        self.HEADER.pack_into(table, 0, self.MAGIC, 1, slots)
+        for key, data in entries.items():
+            i = key & (slots - 1)
+            while self.SLOT.unpack_from(table, self.HEADER.size + i * self.SLOT.size)[1] != 0:
+                i = (i + 1) & (slots - 1)
+            self.SLOT.pack_into(table, self.HEADER.size + i * self.SLOT.size, key, data)
+        # Write a new file and swap it in, so readers never see a partial table
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(table)
+        os.replace(temp_path, self.path)
+        self.new = {}
+        self.open()
+        return len(entries)
+
+def combination_rank(cells, n):
+    """Index of the sorted tuple cells in itertools.combinations(range(n), len(cells))"""
+    k = len(cells)
+    return comb(n, k) - 1 - sum(comb(n-1-c, k-i) for i, c in enumerate(cells))
+
+class Tablebase:
+    """Win/loss table for every balanced position with at least min_pieces pieces.
+    Layer k holds one bit per position (set when player 1 wins), indexed by the rank
+    of the occupied cells and then the rank of player 1's cells among them."""
+    MAGIC = b"A2TB"
+    HEADER = struct.Struct("<4sBBddB")
+
+    def __init__(self, width, height, handicap, cutoff, min_pieces, layers):
+        self.width = width
+        self.height = height
+        self.handicap = handicap
+        self.cutoff = cutoff
+        self.min_pieces = min_pieces
+        self.max_empty = width * height - min_pieces
+        self.layers = layers
+
+    @staticmethod
+    def path_for(width, height, handicap, cutoff):
+        cutoff = 0 if cutoff == float("inf") else cutoff
+        return os.path.join(TABLEBASE_DIR, f"a2_tb_{width}x{height}_{handicap}_{cutoff}.bin")
+
+    @staticmethod
+    def layer_size(n, k):
+        return comb(n, k) * comb(k, (k+1) // 2)
+
+    @classmethod
+    def generate(cls, width, height, handicap, cutoff, max_empty):
+        """Retrograde analysis from the full board back to max_empty empty cells"""
+        n = width * height
+        min_pieces = max(0, n - max_empty)
+        bits = BitBoard(width, height, [[0] * width for _ in range(height)])
+        cell_bits = [bits.bit(i % width, i // width) for i in range(n)]
+        shift = bits.stride * height
+        layers = {}
+        parent_winners = None
+        for k in range(n, min_pieces - 1, -1):
+            p1_count = (k+1) // 2
+            to_play = 1 if k % 2 == 0 else 2
+            layer = bytearray((cls.layer_size(n, k) + 7) // 8)
+            winners = {}
+            index = 0
+            for occupied in combinations(range(n), k):
+                occupied_mask = sum(cell_bits[c] for c in occupied)
+                empty = [cell_bits[c] for c in range(n) if not occupied_mask & cell_bits[c]]
+                for p1_cells in combinations(occupied, p1_count):
+                    m1 = sum(cell_bits[c] for c in p1_cells)
+                    m2 = occupied_mask ^ m1
+                    winner = 0
+                    if k == n or cutoff != float("inf"):
+                        p1_score = bits.line_score(m1)
+                        p2_score = handicap + bits.line_score(m2)
+                        if p1_score >= cutoff:
+                            winner = 1
+                        elif p2_score >= cutoff:
+                            winner = 2
+                        elif k == n:
+                            winner = 1 if p1_score > p2_score else 2
+                    if not winner:
+                        winner = 3 - to_play
+                        for b in empty:
+                            if to_play == 1:
+                                child = (m1 | b) | (m2 << shift)
+                            else:
+                                child = m1 | ((m2 | b) << shift)
+                            if parent_winners[child] == to_play:
+                                winner = to_play
+                                break
+                    if winner == 1:
+                        layer[index >> 3] |= 1 << (index & 7)
+                    winners[m1 | (m2 << shift)] = winner
+                    index += 1
+            layers[k] = layer
+            parent_winners = winners
+        return cls(width, height, handicap, cutoff, min_pieces, layers)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.width, self.height, self.handicap, self.cutoff, self.min_pieces))
+            for k in range(self.min_pieces, self.width * self.height + 1):
+                f.write(self.layers[k])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, width, height, handicap, cutoff, min_pieces = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise ValueError("not a tablebase file: " + path)
+        n = width * height
+        layers = {}
+        offset = cls.HEADER.size
+        for k in range(min_pieces, n + 1):
+            size = (cls.layer_size(n, k) + 7) // 8
+            layers[k] = data[offset:offset + size]
+            offset += size
+        return cls(width, height, handicap, cutoff, min_pieces, layers)
+
+    def lookup(self, board, to_play):
+        """Winner of the position, or 0 if the table does not cover it"""
+        n = self.width * self.height
+        occupied = []
+        p1_cells = []
+        i = 0
+        for row in board:
+            for c in row:
+                if c != 0:
+                    if c == 1:
+                        p1_cells.append(len(occupied))
+                    occupied.append(i)
+                i += 1
+        k = len(occupied)
+        # Only balanced positions are stored, with player 1 to move after an even number of pieces
+        if k < self.min_pieces or len(p1_cells) != (k+1) // 2 or to_play != (1 if k % 2 == 0 else 2):
+            return 0
+        index = combination_rank(occupied, n) * comb(k, len(p1_cells)) + combination_rank(p1_cells, k)
+        return 1 if self.layers[k][index >> 3] >> (index & 7) & 1 else 2
+
 class CommandInterface:
     def __init__(self):
         self.command_dict = {
@@ -15,7 +514,19 @@ class CommandInterface:
             "show"     : self.show,
             "timelimit": self.timelimit,
             "solve"    : self.solve,
-            "score"    : self.score
+            "score"    : self.score,
+            "backend"  : self.backend,
+            "ttsize"   : self.ttsize,
+            "solver"   : self.solver,
+            "workers"  : self.workers,
+            "book_flush": self.book_flush,
+            "tablebase": self.tablebase_cmd,
+            "solve_batch": self.solve_batch,
+            "stats": self.stats,
+            "trace": self.trace_cmd,
+            "ponder": self.ponder_cmd,
+            "play": self.play,
+            "undo": self.undo
         }
 
         # Game state
@@ -23,17 +534,74 @@ class CommandInterface:
         self.player = 1
         self.handicap = 0.0
         self.score_cutoff = float("inf")
-        self.transposition_table = {}
+        self.p1_score = 0
+        self.p2_score = 0
+        self.score_deltas = []
+        self.use_bitboard = False
+        self.bits = None
+        self.zobrist = None
+        self.zobrist_side = 0
+        self.sym_maps = []
+        self.sym_inverse = []
+        self.sym_zobrist = None
+        self.hashes = [0]
+        self.cells = array("b")
+        self.cell_index = [[]]
+        self.line_offsets = ()
+        self.neighbour_offsets = ()
+        self.empty_cells = []
+        self.empty_index = []
+        self.empty_swaps = []
+        self.centre_rank = {}
+        self.transposition_table = TranspositionTable(16)
+        self.game_params = None
+        self.solver_mode = "negamax"
+        self.pn_table = {}
+        self.worker_count = 1
+        self.stop_flag = None
+        self.book = PositionBook(BOOK_PATH)
+        self.tablebase = None
         self.timelimit = 1
-        self.start_time = 0
-        self.timeout = False
+        self.deadline = None
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.iterations = []
+        self.solve_source = None
+        self.solve_time = 0
+        # Where the last search ran when its counters stayed in another process, else None
+        self.remote_search = None
+        self.trace = False
+        self.pondering = False
+        self.ponder_thread = None
+        self.ponder_stopped = False
+        self.ponder_deadline = None
+        self.last_solution = None
+        self.move_history = []
+        self.next_check = 0
+        self.check_interval = 1
+        self.last_check_time = 0
+        self.last_iteration = None
+        self.search_depth = 0
+        self.pv = ()
+        self.follow_pv = False
+        self.pv_table = []
+        self.killers = []
+        self.history = {}
 
     def process_command(self, s):
+        original = s.strip()
         s = s.lower().strip()
         if len(s) == 0:
             return True
         command = s.split(" ")[0]
         args = [x for x in s.split(" ")[1:] if len(x) > 0]
+        if command == "solve_batch":
+            # File paths are case sensitive
+            args = [x for x in original.split(" ")[1:] if len(x) > 0]
         if command not in self.command_dict:
             print("? Unknown command.\nType 'help' to list known commands.", file=sys.stderr)
             print("= -1\n")
@@ -49,11 +617,15 @@ class CommandInterface:
     def main_loop(self):
         while True:
             s = input()
+            # Pondering shares the tables, so it must finish before any command runs
+            self.stop_pondering()
             if s.split(" ")[0] == "exit":
                 print("= 1\n")
                 return True
             if self.process_command(s):
                 print("= 1\n")
+                if self.pondering and s.split(" ")[0] in ("init_game", "solve"):
+                    self.start_pondering(s.split(" ")[0] == "solve")
 
     def help(self, args):
         for command in self.command_dict:
@@ -93,47 +665,97 @@ class CommandInterface:
             print("Invalid board size:", w, h, file=sys.stderr)
             return False
         
-        self.width = w
-        self.height = h
-        self.handicap = p
-        if s == 0:
-            self.score_cutoff = float("inf")
-        else:
-            self.score_cutoff = s
-        
-        self.board = []
-        for r in range(self.height):
-            self.board.append([0]*self.width)
-        self.to_play = 1
+        # Parse the board before changing anything, so a bad board string leaves the old game intact
+        board = []
+        for r in range(h):
+            board.append([0]*w)
+        to_play = 1
 
         if len(self.board_str) > 0:
             board_rows = self.board_str.split("/")
-            if len(board_rows) != self.height:
+            if len(board_rows) != h:
                 print("Board string has wrong height.", file=sys.stderr)
                 return False
             
             p1_count = 0
             p2_count = 0
             for y, row_str in enumerate(board_rows):
-                if len(row_str) != self.width:
+                if len(row_str) != w:
                     print("Board string has wrong width.", file=sys.stderr)
                     return False
                 for x, c in enumerate(row_str):
                     if c == "1":
-                        self.board[y][x] = 1
+                        board[y][x] = 1
                         p1_count += 1
                     elif c == "2":
-                        self.board[y][x] = 2
+                        board[y][x] = 2
                         p2_count += 1
             
             if p1_count > p2_count:
-                self.to_play = 2
+                to_play = 2
             else:
-                self.to_play = 1
+                to_play = 1
+
+        self.width = w
+        self.height = h
+        self.handicap = p
+        if s == 0:
+            self.score_cutoff = float("inf")
+        else:
+            self.score_cutoff = s
+        self.board = board
+        self.to_play = to_play
         
-        self.transposition_table.clear()
+        self.sync_state()
+        self.last_solution = None
+        # Keys identify the whole position, so the table is only stale if the rules changed
+        if self.game_params != (w, h, p, self.score_cutoff):
+            self.game_params = (w, h, p, self.score_cutoff)
+            self.transposition_table.clear()
+            path = Tablebase.path_for(w, h, p, self.score_cutoff)
+            self.tablebase = Tablebase.load(path) if os.path.exists(path) else None
+        return True
+
+    def play(self, args):
+        """Place a piece for the player to move without rebuilding the game state"""
+        if not self.arg_check(args, "x y"):
+            return False
+        x, y = args[0], args[1]
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            print("Move out of bounds:", x, y, file=sys.stderr)
+            return False
+        if self.board[y][x] != 0:
+            print("Cell is not empty:", x, y, file=sys.stderr)
+            return False
+        if self.is_terminal()[0]:
+            print("Game is over.", file=sys.stderr)
+            return False
+        self.make_move(x, y)
+        # Same rule as init_game: player 2 moves whenever player 1 has more pieces
+        to_play = 2 if self.bits.masks[1].bit_count() > self.bits.masks[2].bit_count() else 1
+        switched = to_play != self.to_play
+        if switched:
+            self.switch_side()
+        self.move_history.append((x, y, switched))
+        self.last_solution = None
         return True
 
+    def undo(self, args):
+        if not self.move_history:
+            print("No moves to undo.", file=sys.stderr)
+            return False
+        x, y, switched = self.move_history.pop()
+        if switched:
+            self.switch_side()
+        self.undo_move(x, y)
+        self.last_solution = None
+        return True
+
+    def switch_side(self):
+        # Hand the move to the other player without placing a piece
+        self.to_play = 3 - self.to_play
+        self.hashes = [h ^ self.zobrist_side for h in self.hashes]
+
     def show(self, args):
         for row in self.board:
             print(" ".join(["_" if v == 0 else str(v) for v in row]))
@@ -142,96 +764,302 @@ class CommandInterface:
     def timelimit(self, args):
         if not self.arg_check(args, "s"):
             return False
-        self.timelimit = int(args[0])
+        self.timelimit = args[0]
         return True
     
+    def backend(self, args):
+        if len(args) < 1 or args[0] not in ("list", "bitboard"):
+            print("Expected arguments: list|bitboard", file=sys.stderr)
+            return False
+        self.use_bitboard = args[0] == "bitboard"
+        if hasattr(self, "width"):
+            self.sync_state()
+        return True
+
+    def solver(self, args):
+        if len(args) < 1 or args[0] not in ("negamax", "pns", "mcts"):
+            print("Expected arguments: negamax|pns|mcts", file=sys.stderr)
+            return False
+        self.solver_mode = args[0]
+        return True
+
+    def ttsize(self, args):
+        if not self.arg_check(args, "mb"):
+            return False
+        if args[0] <= 0:
+            print("Table size must be positive.", file=sys.stderr)
+            return False
+        if self.worker_count > 1:
+            self.transposition_table = SharedTranspositionTable(args[0])
+        else:
+            self.transposition_table = TranspositionTable(args[0])
+        return True
+
+    def workers(self, args):
+        if not self.arg_check(args, "n"):
+            return False
+        if args[0] < 1:
+            print("Need at least one worker.", file=sys.stderr)
+            return False
+        shared = isinstance(self.transposition_table, SharedTranspositionTable)
+        self.worker_count = int(args[0])
+        if (self.worker_count > 1) != shared:
+            # Worker processes need the table in shared memory
+            self.ttsize([str(self.transposition_table.megabytes)])
+        return True
+
+    def tablebase_cmd(self, args):
+        n = self.width * self.height
+        if len(args) > 0:
+            if not self.arg_check(args, "e"):
+                return False
+            max_empty = min(n, int(args[0]))
+        else:
+            max_empty = n
+        size = sum(Tablebase.layer_size(n, k) for k in range(n - max_empty, n + 1))
+        if size > TABLEBASE_LIMIT:
+            print(f"Tablebase would have {size} positions, use fewer empty cells.", file=sys.stderr)
+            return False
+        self.tablebase = Tablebase.generate(self.width, self.height, self.handicap, self.score_cutoff, max_empty)
+        self.tablebase.save(Tablebase.path_for(self.width, self.height, self.handicap, self.score_cutoff))
+        return True
+
+    def tablebase_winner(self):
+        """Winner according to the tablebase, or 0 if there is none for this position"""
+        if self.tablebase is None or len(self.empty_cells) > self.tablebase.max_empty:
+            return 0
+        return self.tablebase.lookup(self.board, self.to_play)
+
+    def tablebase_solve(self):
+        """(winner, move) straight from the tablebase, or None if it does not cover the root"""
+        winner = self.tablebase_winner()
+        if not winner:
+            return None
+        if winner != self.to_play:
+            return winner, None
+        for move in self.get_moves():
+            self.make_move(move[0], move[1])
+            child_winner = self.tablebase_winner()
+            self.undo_move(move[0], move[1])
+            if child_winner == winner:
+                return winner, move
+        return winner, None
+
+    def book_flush(self, args):
+        count = self.book.flush()
+        print(f"{count} positions in {self.book.path}", file=sys.stderr)
+        return True
+
+    def book_key(self):
+        """Canonical position key mixed with the rules that decide its result"""
+        key, sym = self.canonical_key()
+        # A fixed encoding, unlike hash(), so book files stay valid across Python versions
+        rules = 0
+        for (word,) in struct.iter_unpack("<Q", struct.pack("<dddd", self.width, self.height,
+                                                            self.handicap, self.score_cutoff)):
+            rules = ((rules ^ word) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return key ^ rules, sym
+
+    def book_lookup(self):
+        key, sym = self.book_key()
+        result = self.book.lookup(key)
+        if result is None:
+            return None
+        winner, move, depth = result
+        if move is not None:
+            # Stored in the canonical frame
+            move = self.sym_maps[self.sym_inverse[sym]][move[1]][move[0]]
+        return winner, move
+
+    def book_store(self, winner, move, depth):
+        key, sym = self.book_key()
+        if move is not None:
+            move = self.sym_maps[sym][move[1]][move[0]]
+        self.book.add(key, winner, move, depth)
+
     def get_moves(self):
-        moves = []
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.board[y][x] == 0:
-                    moves.append((x, y))
-        return moves
+        if self.use_bitboard:
+            return self.bits.cells(self.bits.empty())
+        return self.empty_cells[:]
 
     def make_move(self, x, y):
+        delta = self.score_delta(x, y, self.to_play)
+        self.score_deltas.append(delta)
         self.board[y][x] = self.to_play
+        self.cells[self.cell_index[y][x]] = self.to_play
+        self.hashes = [h ^ k for h, k in zip(self.hashes, self.sym_zobrist[y][x][self.to_play])]
+        self.bits.masks[self.to_play] ^= self.bits.bit(x, y)
+        # Swap-remove from the empty cells, remembering where it was for undo
+        i = self.empty_index[y * self.width + x]
+        last = self.empty_cells.pop()
+        if last != (x, y):
+            self.empty_cells[i] = last
+            self.empty_index[last[1] * self.width + last[0]] = i
+        self.empty_swaps.append(i)
         self.last_player = self.to_play
         if self.to_play == 1:
+            self.p1_score += delta
             self.to_play = 2
         else:
+            self.p2_score += delta
             self.to_play = 1
 
     def undo_move(self, x, y):
         self.board[y][x] = 0
+        self.cells[self.cell_index[y][x]] = 0
+        delta = self.score_deltas.pop()
+        self.hashes = [h ^ k for h, k in zip(self.hashes, self.sym_zobrist[y][x][3 - self.to_play])]
+        self.bits.masks[3 - self.to_play] ^= self.bits.bit(x, y)
+        # Undo the swap-remove, restoring the empty cells in their old order
+        i = self.empty_swaps.pop()
+        if i < len(self.empty_cells):
+            moved = self.empty_cells[i]
+            self.empty_index[moved[1] * self.width + moved[0]] = len(self.empty_cells)
+            self.empty_cells.append(moved)
+            self.empty_cells[i] = (x, y)
+        else:
+            self.empty_cells.append((x, y))
+        self.empty_index[y * self.width + x] = i
         if self.to_play == 1:
+            self.p2_score -= delta
             self.to_play = 2
         else:
+            self.p1_score -= delta
             self.to_play = 1
 
-    def calculate_score(self):
-        p1_score = 0
-        p2_score = self.handicap
-
+    def sync_state(self):
+        """Recompute everything derived from self.board after it is replaced"""
+        if len(self.cell_index) != self.height or len(self.cell_index[0]) != self.width:
+            # Flat board layout: one border cell on every side, so runs stop without bounds checks
+            stride = self.width + 2
+            self.cell_index = [[(y+1) * stride + x+1 for x in range(self.width)] for y in range(self.height)]
+            self.line_offsets = (1, stride, stride + 1, stride - 1)
+            self.neighbour_offsets = tuple(dy * stride + dx for dx, dy in NEIGHBOURS)
+        self.cells = array("b", [-1]) * ((self.width + 2) * (self.height + 2))
         for y in range(self.height):
             for x in range(self.width):
-                c = self.board[y][x]
-                if c != 0:
-                    lone_piece = True
-                    # Horizontal
-                    hl = 1
-                    if x == 0 or self.board[y][x-1] != c:
-                        x1 = x+1
-                        while x1 < self.width and self.board[y][x1] == c:
-                            hl += 1
-                            x1 += 1
-                    else:
-                        lone_piece = False
-                    # Vertical
-                    vl = 1
-                    if y == 0 or self.board[y-1][x] != c:
-                        y1 = y+1
-                        while y1 < self.height and self.board[y1][x] == c:
-                            vl += 1
-                            y1 += 1
-                    else:
-                        lone_piece = False
-                    # Diagonal
-                    dl = 1
-                    if y == 0 or x == 0 or self.board[y-1][x-1] != c:
-                        x1 = x+1
-                        y1 = y+1
-                        while x1 < self.width and y1 < self.height and self.board[y1][x1] == c:
-                            dl += 1
-                            x1 += 1
-                            y1 += 1
-                    else:
-                        lone_piece = False
-                    # Anti-diagonal
-                    al = 1
-                    if y == 0 or x == self.width-1 or self.board[y-1][x+1] != c:
-                        x1 = x-1
-                        y1 = y+1
-                        while x1 >= 0 and y1 < self.height and self.board[y1][x1] == c:
-                            al += 1
-                            x1 -= 1
-                            y1 += 1
-                    else:
-                        lone_piece = False
-                    
-                    for line_length in [hl, vl, dl, al]:
-                        if line_length > 1:
-                            if c == 1:
-                                p1_score += 2 ** (line_length-1)
-                            else:
-                                p2_score += 2 ** (line_length-1)
-                    
-                    if hl == vl == dl == al == 1 and lone_piece:
-                        if c == 1:
-                            p1_score += 1
-                        else:
-                            p2_score += 1
-
-        return p1_score, p2_score
+                self.cells[self.cell_index[y][x]] = self.board[y][x]
+        # The masks are kept in both backends since the score bounds need them
+        self.bits = BitBoard(self.width, self.height, self.board)
+        if self.use_bitboard:
+            self.p1_score = self.bits.line_score(self.bits.masks[1])
+            self.p2_score = self.handicap + self.bits.line_score(self.bits.masks[2])
+        else:
+            self.p1_score, self.p2_score = self.full_score()
+        self.score_deltas = []
+        self.empty_cells = [(x, y) for y in range(self.height) for x in range(self.width) if self.board[y][x] == 0]
+        self.empty_index = [0] * (self.width * self.height)
+        for i, (x, y) in enumerate(self.empty_cells):
+            self.empty_index[y * self.width + x] = i
+        self.empty_swaps = []
+        # The undo stacks are gone, so moves made with play can no longer be taken back
+        self.move_history = []
+
+        if self.zobrist is None or len(self.zobrist) != self.height or len(self.zobrist[0]) != self.width:
+            # Fixed seed so keys are the same in every process
+            rng = random.Random(455)
+            self.zobrist = [[[0, rng.getrandbits(64), rng.getrandbits(64)] for x in range(self.width)]
+                            for y in range(self.height)]
+            self.zobrist_side = rng.getrandbits(64)
+            # Position of each cell when sorted by distance from the centre, ties in row order
+            center_x, center_y = self.width // 2, self.height // 2
+            cells = sorted(((x, y) for y in range(self.height) for x in range(self.width)),
+                           key=lambda move: (abs(move[0] - center_x) + abs(move[1] - center_y), move[1], move[0]))
+            self.centre_rank = {move: rank for rank, move in enumerate(cells)}
+            # One key per symmetry: the key of the cell this one maps to, with the side to move folded in
+            self.sym_maps, self.sym_inverse = symmetries(self.width, self.height)
+            self.sym_zobrist = [[[[self.zobrist[m[y][x][1]][m[y][x][0]][c] ^ self.zobrist_side for m in self.sym_maps]
+                                  for c in range(3)] for x in range(self.width)] for y in range(self.height)]
+        # hashes[s] is the Zobrist key of the position transformed by symmetry s
+        self.hashes = [0] * len(self.sym_maps)
+        for s, m in enumerate(self.sym_maps):
+            for y in range(self.height):
+                for x in range(self.width):
+                    x1, y1 = m[y][x]
+                    self.hashes[s] ^= self.zobrist[y1][x1][self.board[y][x]]
+            if self.to_play == 2:
+                self.hashes[s] ^= self.zobrist_side
+
+    def canonical_key(self):
+        """Smallest key over the board's symmetries, and the symmetry that produced it"""
+        key = min(self.hashes)
+        return key, self.hashes.index(key)
+
+    def unique_moves(self, moves):
+        """Drop moves that mirror an earlier move under a symmetry of the current position"""
+        hashes = self.hashes
+        if hashes.count(hashes[0]) == 1:
+            return moves
+        fixing = [self.sym_maps[s] for s in range(1, len(hashes)) if hashes[s] == hashes[0]]
+        seen = set()
+        unique = []
+        for x, y in moves:
+            if (x, y) in seen:
+                continue
+            unique.append((x, y))
+            for m in fixing:
+                seen.add(m[y][x])
+        return unique
+
+    def run_length(self, p, d, c):
+        # Number of c pieces starting at cell p and stepping by offset d; the border stops it
+        cells = self.cells
+        length = 0
+        while cells[p] == c:
+            length += 1
+            p += d
+        return length
+
+    def is_lone(self, p, c):
+        cells = self.cells
+        for offset in self.neighbour_offsets:
+            if cells[p + offset] == c:
+                return False
+        return True
+
+    def score_delta(self, x, y, c):
+        """Change in c's score from placing c on the empty cell (x, y)"""
+        return self.cell_delta(self.cell_index[y][x], c)
+
+    def cell_delta(self, p, c):
+        # score_delta for the flat board index p
+        delta = 0
+        lone_piece = True
+        # Only the four lines through (x, y) change: two runs merge into one
+        for d in self.line_offsets:
+            back = self.run_length(p-d, -d, c)
+            forward = self.run_length(p+d, d, c)
+            if back or forward:
+                lone_piece = False
+            delta += LINE_VALUE[back+forward+1] - LINE_VALUE[back] - LINE_VALUE[forward]
+        if lone_piece:
+            delta += 1
+        else:
+            # Neighbours that were lone pieces lose their lone piece point
+            cells = self.cells
+            for offset in self.neighbour_offsets:
+                if cells[p + offset] == c and self.is_lone(p + offset, c):
+                    delta -= 1
+        return delta
+
+    def calculate_score(self):
+        return self.p1_score, self.p2_score
+
+    def full_score(self):
+        scores = [0, 0, self.handicap]
+        cells = self.cells
+        for row in self.cell_index:
+            for p in row:
+                c = cells[p]
+                if c == 0:
+                    continue
+                # Count each line once, from the end with no c piece behind it
+                for d in self.line_offsets:
+                    if cells[p-d] != c:
+                        scores[c] += LINE_VALUE[self.run_length(p, d, c)]
+                if self.is_lone(p, c):
+                    scores[c] += 1
+        return scores[1], scores[2]
     
     def score(self, args):
         p1, p2 = self.calculate_score()
@@ -245,30 +1073,81 @@ class CommandInterface:
         elif p2_score >= self.score_cutoff:
             return True, 2
         else:
-            for y in range(self.height):
-                for x in range(self.width):
-                    if self.board[y][x] == 0:
-                        return False, 0
+            if self.use_bitboard:
+                if self.bits.empty():
+                    return False, 0
+            elif self.empty_cells:
+                return False, 0
             if p1_score > p2_score:
                 return True, 1
             else:
                 return True, 2
 
+    def settled_winner(self):
+        """Winner that no sequence of remaining moves can change, or 0 if still open.
+        Scores never decrease, and a player's score is largest if they get every empty cell."""
+        if self.p2_score >= self.p1_score:
+            p1_max = self.bits.line_score(self.bits.masks[1] | self.bits.empty())
+            if p1_max < self.score_cutoff and self.p2_score >= p1_max:
+                return 2
+        else:
+            p2_max = self.handicap + self.bits.line_score(self.bits.masks[2] | self.bits.empty())
+            if p2_max < self.score_cutoff and self.p1_score > p2_max:
+                return 1
+        return 0
+
     # ---------- A2: Fixed Implementation ----------
 
+    def start_clock(self, deadline):
+        self.deadline = deadline if deadline is not None else Deadline(self.timelimit)
+        self.last_check_time = time.monotonic()
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.iterations = []
+        self.check_interval = 1
+        self.next_check = 1
+
     def check_time(self):
-        return time.time() - self.start_time > self.timelimit
+        """Read the clock, called once every check_interval nodes.
+        The interval is rescaled so clock reads happen about every CHECK_PERIOD seconds."""
+        now = time.monotonic()
+        if self.deadline.expired():
+            raise SearchTimeout("Search timed out")
+        if self.stop_flag is not None and self.stop_flag.value:
+            raise SearchTimeout("Search cancelled")
+        elapsed = now - self.last_check_time
+        if elapsed > 0:
+            self.check_interval = max(1, min(2 * self.check_interval, int(self.check_interval * CHECK_PERIOD / elapsed)))
+        else:
+            self.check_interval *= 2
+        self.last_check_time = now
+        self.next_check = self.nodes + self.check_interval
 
-    def solver_implementation(self):
-        self.start_time = time.time()
-        self.timeout = False
+    def solver_implementation(self, root_moves=None, deadline=None):
+        self.start_clock(deadline)
+        self.last_iteration = None
+        self.transposition_table.new_search()
         
         # Quick terminal check
         is_terminal, winner = self.is_terminal()
         if is_terminal:
             return winner, None
         
-        moves = self.get_moves()
+        all_moves = self.get_moves()
+        winner = self.settled_winner()
+        if winner == self.to_play:
+            return winner, all_moves[0]
+        elif winner:
+            return winner, None
+
+        if root_moves is None:
+            moves = self.unique_moves(all_moves)
+        else:
+            moves = list(root_moves)
         if not moves:
             p1_score, p2_score = self.calculate_score()
             winner = 1 if p1_score > p2_score else 2
@@ -277,53 +1156,155 @@ class CommandInterface:
         # Use negamax framework for simpler implementation
         best_move = None
         best_value = -float('inf')
+        moves = self.move_ordering(moves)
+        self.pv = ()
+        self.pv_table = [()] * (len(all_moves) + 2)
+        self.killers = [[None, None] for _ in range(len(all_moves) + 2)]
+        self.history = {}
         
-        try:
-            # Try each move with iterative deepening
-            for depth in range(1, min(8, len(moves)) + 1):
-                if self.check_time():
-                    raise TimeoutError()
-                
-                current_best_move = None
-                current_best_value = -float('inf')
-                
-                for move in moves:
-                    if self.check_time():
-                        raise TimeoutError()
-                    
-                    self.make_move(move[0], move[1])
-                    value = -self.negamax(depth-1, -float('inf'), float('inf'))
-                    self.undo_move(move[0], move[1])
-                    
-                    if value > current_best_value:
-                        current_best_value = value
-                        current_best_move = move
-                
-                best_move = current_best_move
-                best_value = current_best_value
-                
-                # If we found a guaranteed win, return immediately
-                if best_value == float('inf'):
-                    return self.to_play, best_move
-                # If all moves lead to loss, opponent wins
-                elif best_value == -float('inf'):
-                    opponent = 2 if self.to_play == 1 else 1
-                    return opponent, None
+        # Try each move with iterative deepening, up to filling every empty cell
+        for depth in range(1, len(all_moves) + 1):
+            self.search_depth = depth
+            root_values = {}
+            iteration_nodes = self.nodes
+            iteration_start = time.monotonic()
+
+            # Aspiration window around the previous iteration's value, widened on failure
+            if best_value in (float('inf'), -float('inf')):
+                alpha, beta = -float('inf'), float('inf')
+            else:
+                alpha, beta = best_value - ASPIRATION_WINDOW, best_value + ASPIRATION_WINDOW
+            while True:
+                current_best_value, current_best_move = self.search_root(depth, alpha, beta, moves, root_values)
+                if current_best_value in (float('inf'), -float('inf')):
+                    # Proven, whichever side of the window it fell on
+                    break
+                if current_best_value <= alpha:
+                    alpha = -float('inf')
+                elif current_best_value >= beta:
+                    beta = float('inf')
+                else:
+                    break
+            
+            best_move = current_best_move
+            best_value = current_best_value
+            # Next iteration searches the best root moves of this one first
+            moves.sort(key=lambda move: -root_values.get(move, -float('inf')))
+            if best_move is not None:
+                moves.remove(best_move)
+                moves.insert(0, best_move)
+            # Answer of the last fully completed iteration, kept if the next one times out
+            self.last_iteration = (depth, best_move, best_value)
+            self.record_iteration(depth, self.nodes - iteration_nodes, time.monotonic() - iteration_start, best_value, best_move)
             
-            # If we complete search without finding forced win/loss
-            if best_value > 0:
+            # If we found a guaranteed win, return immediately
+            if best_value == float('inf'):
                 return self.to_play, best_move
-            else:
+            # If all moves lead to loss, opponent wins
+            elif best_value == -float('inf'):
                 opponent = 2 if self.to_play == 1 else 1
                 return opponent, None
-                
+        
+        # If we complete search without finding forced win/loss
+        if best_value > 0:
+            return self.to_play, best_move
+        else:
+            opponent = 2 if self.to_play == 1 else 1
+            return opponent, None
+
+    def parallel_implementation(self, deadline=None):
+        """Split the root moves over forked worker processes sharing the transposition table.
+        The first worker to prove a win cancels the others."""
+        self.start_clock(deadline)
+        is_terminal, winner = self.is_terminal()
+        if is_terminal:
+            return winner, None
+        all_moves = self.get_moves()
+        winner = self.settled_winner()
+        if winner == self.to_play:
+            return winner, all_moves[0]
+        elif winner:
+            return winner, None
+
+        moves = self.move_ordering(self.unique_moves(all_moves))
+        count = min(self.worker_count, len(moves))
+        context = multiprocessing.get_context("fork")
+        self.stop_flag = context.Value("b", 0, lock=False)
+        results = context.Queue()
+        processes = [context.Process(target=self.search_worker, args=(moves[i::count], results), daemon=True)
+                     for i in range(count)]
+        try:
+            for process in processes:
+                process.start()
+            finished = 0
+            while finished < count:
+                try:
+                    winner, move = results.get(timeout=max(0, self.deadline.remaining()) + CHECK_PERIOD)
+                except queue.Empty:
+                    raise SearchTimeout("Search timed out")
+                if winner == 0:
+                    raise SearchTimeout("Search timed out")
+                if winner == self.to_play:
+                    return winner, move
+                finished += 1
+            # Every worker proved that all of its moves lose
+            return 3 - self.to_play, None
+        finally:
+            self.stop_flag.value = 1
+            for process in processes:
+                process.join(CHECK_PERIOD)
+                if process.is_alive():
+                    process.terminate()
+            self.stop_flag = None
+
+    def search_worker(self, moves, results):
+        # Runs in a forked child; winner 0 reports a timeout or cancellation
+        try:
+            results.put(self.solver_implementation(moves, self.deadline))
         except TimeoutError:
-            raise TimeoutError("Search timed out")
+            results.put((0, None))
+
+    def search_root(self, depth, alpha, beta, moves, root_values):
+        """One principal variation search of the root moves, returns (value, move)"""
+        # The first root move is the previous principal variation; follow it down
+        self.follow_pv = len(self.pv) > 0
+        best_value = -float('inf')
+        best_move = None
+        for i, move in enumerate(moves):
+            self.make_move(move[0], move[1])
+            value = self.pvs_child(i, depth, alpha, beta)
+            self.undo_move(move[0], move[1])
+            self.follow_pv = False
+            root_values[move] = value
+
+            if value > best_value:
+                best_value = value
+                best_move = move
+                self.pv = (move,) + self.pv_table[1]
+            if value > alpha:
+                alpha = value
+            if alpha >= beta:
+                break
+        return best_value, best_move
+
+    def pvs_child(self, i, depth, alpha, beta):
+        """Value of the child just moved to, from the parent's side: the first child gets
+        the full window, later ones a null window that is widened only if they fail high"""
+        if i == 0 or alpha == -float('inf'):
+            return -self.negamax(depth-1, -beta, -alpha)
+        # Values seen at one node all differ by whole points, so alpha+1 is a null window
+        value = -self.negamax(depth-1, -alpha-1, -alpha)
+        if alpha < value < beta:
+            value = -self.negamax(depth-1, -beta, -alpha)
+        return value
 
     def negamax(self, depth, alpha, beta):
         """Negamax implementation - simpler and more correct"""
-        if self.check_time():
-            return 0
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_time()
+        ply = self.search_depth - depth
+        self.pv_table[ply] = ()
             
         # Check terminal state
         is_terminal, winner = self.is_terminal()
@@ -332,6 +1313,14 @@ class CommandInterface:
                 return float('inf')
             else:
                 return -float('inf')
+
+        # Decided by the score bounds before the board fills, or by the tablebase
+        winner = self.settled_winner() or self.tablebase_winner()
+        if winner:
+            if winner == self.to_play:
+                return float('inf')
+            else:
+                return -float('inf')
         
         if depth == 0:
             # Evaluation from current player's perspective
@@ -341,70 +1330,650 @@ class CommandInterface:
             else:
                 return p2_score - p1_score
         
-        moves = self.get_moves()
-        moves = self.move_ordering(moves)
+        # Probe the transposition table
+        alpha_orig = alpha
+        tt_move = None
+        key, sym = self.canonical_key()
+        entry = self.transposition_table.get(key)
+        self.tt_probes += 1
+        if entry is not None:
+            self.tt_hits += 1
+            tt_depth, tt_flag, tt_value, tt_move = entry
+            if tt_move is not None:
+                # Stored in the canonical frame, map back to real coordinates
+                tt_move = self.sym_maps[self.sym_inverse[sym]][tt_move[1]][tt_move[0]]
+            if tt_depth >= depth:
+                if tt_flag == EXACT:
+                    self.tt_cutoffs += 1
+                    return tt_value
+                elif tt_flag == LOWER:
+                    alpha = max(alpha, tt_value)
+                else:
+                    beta = min(beta, tt_value)
+                if alpha >= beta:
+                    self.tt_cutoffs += 1
+                    return tt_value
+
+        moves = self.unique_moves(self.get_moves())
+        pv_move = None
+        if self.follow_pv:
+            if ply < len(self.pv) and self.pv[ply] in moves:
+                pv_move = self.pv[ply]
+            else:
+                self.follow_pv = False
+        moves = self.order_moves(moves, tt_move, pv_move, ply)
         
         best_value = -float('inf')
-        for move in moves:
+        best_move = None
+        for i, move in enumerate(moves):
             self.make_move(move[0], move[1])
-            value = -self.negamax(depth-1, -beta, -alpha)
+            value = self.pvs_child(i, depth, alpha, beta)
             self.undo_move(move[0], move[1])
+            # Only the first child of a principal variation node is on the old variation
+            self.follow_pv = False
             
             if value > best_value:
                 best_value = value
+                best_move = move
+                self.pv_table[ply] = (move,) + self.pv_table[ply+1]
             
             if value > alpha:
                 alpha = value
             
             if alpha >= beta:
+                self.cutoffs += 1
+                if i == 0:
+                    self.first_cutoffs += 1
+                # Remember moves that cause cutoffs for sibling positions
+                killers = self.killers[ply]
+                if killers[0] != move:
+                    killers[1] = killers[0]
+                    killers[0] = move
+                self.history[move] = self.history.get(move, 0) + depth * depth
                 break
+
+        if best_move is not None:
+            best_move = self.sym_maps[sym][best_move[1]][best_move[0]]
+        if best_value <= alpha_orig:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if (best_value == float('inf') and flag != UPPER) or (best_value == -float('inf') and flag != LOWER):
+            self.transposition_table.store(key, PROVEN_DEPTH, EXACT, best_value, best_move)
+        else:
+            self.transposition_table.store(key, depth, flag, best_value, best_move)
                 
         return best_value
 
     def move_ordering(self, moves):
-        center_x, center_y = self.width // 2, self.height // 2
-        moves.sort(key=lambda move: abs(move[0] - center_x) + abs(move[1] - center_y)) 
+        moves.sort(key=self.centre_rank.__getitem__)
         return moves
 
-    def solve(self, args):
-        class TimeoutException(Exception):
+    def order_moves(self, moves, tt_move, pv_move, ply):
+        """Principal variation move, transposition table move, killers, then history score"""
+        moves = self.move_ordering(moves)
+        history = self.history
+        if history:
+            moves.sort(key=lambda move: -history.get(move, 0))
+        first = [pv_move, tt_move] + self.killers[ply]
+        for move in reversed(first):
+            if move is not None and move in moves:
+                moves.remove(move)
+                moves.insert(0, move)
+        return moves
+
+    # ---------- Monte Carlo tree search ----------
+
+    def playout(self):
+        """Winner after filling the rest of the board with random moves"""
+        order = self.empty_cells[:]
+        random.shuffle(order)
+        player = self.to_play
+        if self.score_cutoff == float('inf'):
+            # Nobody can win early, so score the full board once at the end
+            bits = self.bits
+            masks = [0, bits.masks[1], bits.masks[2]]
+            for x, y in order:
+                masks[player] |= bits.bit(x, y)
+                player = 3 - player
+            p1_score = bits.line_score(masks[1])
+            p2_score = self.handicap + bits.line_score(masks[2])
+            return 1 if p1_score > p2_score else 2
+        # Otherwise the first player to reach the cutoff wins; only the mover's score changes
+        cells = self.cells
+        scores = [0, self.p1_score, self.p2_score]
+        placed = []
+        winner = 0
+        for x, y in order:
+            p = self.cell_index[y][x]
+            scores[player] += self.cell_delta(p, player)
+            cells[p] = player
+            placed.append(p)
+            if scores[player] >= self.score_cutoff:
+                winner = player
+                break
+            player = 3 - player
+        for p in placed:
+            cells[p] = 0
+        if not winner:
+            winner = 1 if scores[1] > scores[2] else 2
+        return winner
+
+    def mcts_iteration(self, root):
+        # Selection, expansion, one playout and backpropagation, leaving the board as it was
+        node = root
+        path = []
+        while node.untried is not None and not node.untried and node.children:
+            node = node.select()
+            self.make_move(node.move[0], node.move[1])
+            path.append(node.move)
+        if node.untried is None:
+            is_terminal, node.winner = self.is_terminal()
+            node.untried = [] if is_terminal else self.get_moves()
+            random.shuffle(node.untried)
+        if node.untried:
+            move = node.untried.pop()
+            child = MCTSNode(move, self.to_play, node)
+            node.children.append(child)
+            self.make_move(move[0], move[1])
+            path.append(move)
+            node = child
+            is_terminal, node.winner = self.is_terminal()
+            if is_terminal:
+                node.untried = []
+        winner = node.winner or self.playout()
+        while node is not None:
+            node.visits += 1
+            if winner == node.player:
+                node.wins += 1
+            node = node.parent
+        for move in reversed(path):
+            self.undo_move(move[0], move[1])
+
+    def mcts_implementation(self, deadline=None):
+        """UCT search until the deadline. Returns the predicted winner, with the most visited
+        move if that is the player to move, and reports the win rate on stderr."""
+        self.start_clock(deadline)
+        is_terminal, winner = self.is_terminal()
+        if is_terminal:
+            return winner, None
+        winner = self.settled_winner()
+        if winner:
+            return winner, (self.get_moves()[0] if winner == self.to_play else None)
+
+        root = MCTSNode(None, 3 - self.to_play, None)
+        start = time.monotonic()
+        try:
+            while True:
+                self.nodes += 1
+                if self.nodes >= self.next_check:
+                    self.check_time()
+                self.mcts_iteration(root)
+        except SearchTimeout:
+            # The board is back at the root between iterations
             pass
-            
-        def handler(signum, frame):
-            raise TimeoutException("Function timed out.")
-        
+        if not root.children:
+            raise SearchTimeout("No playouts before the deadline")
+
+        best = max(root.children, key=lambda child: child.visits)
+        # Averaged over every playout from the root, since the most visited child's own rate
+        # is inflated by selection and means little after a few visits. Root wins are the opponent's.
+        win_rate = 1 - root.wins / root.visits
+        seconds = time.monotonic() - start
+        print(f"mcts move {best.move[0]} {best.move[1]} visits {best.visits} win rate {win_rate:.3f} "
+              f"playouts {root.visits} playouts/sec {root.visits / seconds if seconds > 0 else 0:.0f}",
+              file=sys.stderr)
+        if win_rate >= 0.5:
+            return self.to_play, best.move
+        return 3 - self.to_play, None
+
+    # ---------- Proof-number search ----------
+
+    def proven_winner(self):
+        """Winner of the current position if it is already known, otherwise 0"""
+        is_terminal, winner = self.is_terminal()
+        if is_terminal:
+            return winner
+        winner = self.settled_winner() or self.tablebase_winner()
+        if winner:
+            return winner
+        entry = self.transposition_table.get(self.canonical_key()[0])
+        if entry is not None and entry[0] == PROVEN_DEPTH:
+            return self.to_play if entry[2] == float('inf') else 3 - self.to_play
+        return 0
+
+    def store_proven(self, winner, move):
+        key, sym = self.canonical_key()
+        if move is not None:
+            move = self.sym_maps[sym][move[1]][move[0]]
+        value = float('inf') if winner == self.to_play else -float('inf')
+        self.transposition_table.store(key, PROVEN_DEPTH, EXACT, value, move)
+
+    def child_key(self, move):
+        """Canonical key of the position after move, without making it"""
+        x, y = move
+        return min([h ^ k for h, k in zip(self.hashes, self.sym_zobrist[y][x][self.to_play])])
+
+    def pns_initial(self, key):
+        # Proof and disproof numbers of a position not yet searched by pns_mid
+        entry = self.transposition_table.get(key)
+        if entry is not None and entry[0] == PROVEN_DEPTH:
+            return (0, float('inf')) if entry[2] == float('inf') else (float('inf'), 0)
+        return 1, 1
+
+    def pns_mid(self, th_pn, th_dn):
+        """Depth-first proof-number search of the current position until its proof
+        number reaches th_pn or its disproof number reaches th_dn"""
+        self.nodes += 1
+        if self.nodes >= self.next_check:
+            self.check_time()
+        key = self.canonical_key()[0]
+        winner = self.proven_winner()
+        if winner:
+            self.pn_table[key] = (0, float('inf')) if winner == self.to_play else (float('inf'), 0)
+            return
+
+        children = []
+        for move in self.move_ordering(self.unique_moves(self.get_moves())):
+            child_key = self.child_key(move)
+            children.append((move, child_key, self.pns_initial(child_key)))
+        while True:
+            # Our proof is the disproof of the best child, our disproof needs every child proven
+            pn = float('inf')
+            dn = 0
+            second = float('inf')
+            best = None
+            for move, child_key, initial in children:
+                child_pn, child_dn = self.pn_table.get(child_key, initial)
+                dn += child_pn
+                if child_dn < pn:
+                    second = pn
+                    pn = child_dn
+                    best = move
+                    best_pn = child_pn
+                elif child_dn < second:
+                    second = child_dn
+            if pn >= th_pn or dn >= th_dn:
+                break
+            self.make_move(best[0], best[1])
+            self.pns_mid(th_dn - dn + best_pn, min(th_pn, second * 1.25 + 1))
+            self.undo_move(best[0], best[1])
+
+        if len(self.pn_table) >= PN_TABLE_LIMIT:
+            # Only a cache: proven results are also kept in the transposition table
+            self.pn_table.clear()
+        self.pn_table[key] = (pn, dn)
+        if pn == 0:
+            self.store_proven(self.to_play, best)
+        elif dn == 0:
+            self.store_proven(3 - self.to_play, None)
+
+    def pns_implementation(self, deadline=None):
+        """Depth-first proof-number search: proves or disproves a win for the player to move"""
+        self.start_clock(deadline)
+        self.transposition_table.new_search()
+        self.pn_table = {}
+
+        winner = self.proven_winner()
+        if winner:
+            moves = self.get_moves()
+            if winner == self.to_play and moves:
+                return winner, moves[0]
+            return winner, None
+
+        self.pns_mid(float('inf'), float('inf'))
+        pn, dn = self.pn_table[self.canonical_key()[0]]
+        if pn == 0:
+            for move in self.get_moves():
+                child_key = self.child_key(move)
+                if self.pn_table.get(child_key, self.pns_initial(child_key))[1] == 0:
+                    return self.to_play, move
+            # The winning child's proof was evicted from both tables; prove it again
+            for move in self.move_ordering(self.get_moves()):
+                self.make_move(move[0], move[1])
+                winner = self.proven_winner()
+                if not winner:
+                    self.pns_mid(float('inf'), float('inf'))
+                    winner = self.to_play if self.pn_table[self.canonical_key()[0]][0] == 0 else 3 - self.to_play
+                self.undo_move(move[0], move[1])
+                if winner == self.to_play:
+                    return winner, move
+            raise RuntimeError("Root proven but no winning move found")
+        return 3 - self.to_play, None
+
+    def solve(self, args):
+        self.last_solution = self.solve_position()
+        self.print_solution(self.last_solution)
+        return True
+
+    # ---------- Pondering ----------
+
+    def ponder_cmd(self, args):
+        if len(args) < 1 or args[0] not in ("on", "off"):
+            print("Expected arguments: on|off", file=sys.stderr)
+            return False
+        self.pondering = args[0] == "on"
+        return True
+
+    def clone(self):
+        """Copy for another thread, sharing the transposition table, book and tablebase"""
+        other = copy.copy(self)
+        other.board = [row[:] for row in self.board]
+        other.worker_count = 1
+        other.trace = False
+        other.sync_state()
+        return other
+
+    def start_pondering(self, after_solve):
+        """Search the positions the next command will probably ask about in a background thread.
+        After a solve that found a winning move, that move is assumed to be played next."""
+        first_move = None
+        if after_solve and self.last_solution is not None and self.last_solution[1] is not None:
+            first_move = self.last_solution[1]
+        self.last_solution = None
+        if self.solver_mode == "mcts":
+            # Its estimates are not cached anywhere, so there is nothing to prepare
+            return
+        self.ponder_stopped = False
+        self.ponder_thread = threading.Thread(target=self.ponder, args=(self.clone(), first_move), daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        if self.ponder_thread is None:
+            return
+        self.ponder_stopped = True
+        if self.ponder_deadline is not None:
+            self.ponder_deadline.cancel()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        self.ponder_deadline = None
+
+    def ponder(self, interface, first_move):
+        # The position after our answer, then after each of the opponent's replies, best first;
+        # solve_position stores whatever it proves in the shared book and transposition table
+        if first_move is not None:
+            interface.board[first_move[1]][first_move[0]] = interface.to_play
+            interface.to_play = 3 - interface.to_play
+            interface.sync_state()
+        base_board = [row[:] for row in interface.board]
+        base_to_play = interface.to_play
+        positions = [None]
+        if not interface.is_terminal()[0]:
+            positions += interface.move_ordering(interface.get_moves())
+        for move in positions:
+            interface.board = [row[:] for row in base_board]
+            interface.to_play = base_to_play
+            if move is not None:
+                interface.board[move[1]][move[0]] = base_to_play
+                interface.to_play = 3 - base_to_play
+            interface.sync_state()
+            # Assign before checking the flag, so stop_pondering always cancels this deadline
+            self.ponder_deadline = Deadline(interface.timelimit)
+            if self.ponder_stopped:
+                return
+            interface.solve_position(self.ponder_deadline)
+
+    def print_solution(self, result):
+        # Output format: "winner" or "winner x y"
+        if result is None:
+            print("unknown")
+        elif result[1] is not None:
+            print(f"{result[0]} {result[1][0]} {result[1][1]}")
+        else:
+            print(result[0])
+
+    def position(self):
+        """Everything a fresh interface needs to solve the current position"""
+        cutoff = 0 if self.score_cutoff == float("inf") else self.score_cutoff
+        board_str = "/".join("".join("_12"[c] for c in row) for row in self.board)
+        return (self.width, self.height, self.handicap, cutoff, board_str, self.to_play, self.timelimit, self.solver_mode)
+
+    def record_iteration(self, depth, nodes, seconds, value, move):
+        self.iterations.append((depth, nodes, seconds, value, move))
+        if self.trace:
+            print(json.dumps({"depth": depth, "nodes": nodes, "time": round(seconds, 6),
+                              "value": str(value), "move": move, "tt_hits": self.tt_hits,
+                              "cutoffs": self.cutoffs}), file=sys.stderr)
+
+    def trace_cmd(self, args):
+        if len(args) < 1 or args[0] not in ("on", "off"):
+            print("Expected arguments: on|off", file=sys.stderr)
+            return False
+        self.trace = args[0] == "on"
+        return True
+
+    def stats(self, args):
+        """Counters from the last solve"""
+        print("source", self.solve_source)
+        print("time", round(self.solve_time, 6))
+        if self.remote_search is not None:
+            # The counters of this process would describe no search at all
+            print("counters unavailable, the search ran in", self.remote_search)
+            return True
+        print("nodes", self.nodes)
+        print("nodes_per_sec", int(self.nodes / self.solve_time) if self.solve_time > 0 else 0)
+        print("depth", self.iterations[-1][0] if self.iterations else 0)
+        if self.last_iteration is not None and self.last_iteration[1] is not None:
+            # Unproven best move of the deepest completed iteration, useful when solve timed out
+            depth, move, value = self.last_iteration
+            print("last_iteration", depth, move[0], move[1], value)
+        print("tt_probes", self.tt_probes)
+        print("tt_hit_rate", round(self.tt_hits / self.tt_probes, 4) if self.tt_probes else 0)
+        print("tt_cutoffs", self.tt_cutoffs)
+        print("cutoffs", self.cutoffs)
+        print("first_move_cutoff_rate", round(self.first_cutoffs / self.cutoffs, 4) if self.cutoffs else 0)
+        # Growth in nodes from one iteration to the next
+        if len(self.iterations) > 1 and self.iterations[-2][1] > 0:
+            print("branching_factor", round(self.iterations[-1][1] / self.iterations[-2][1], 3))
+        for depth, nodes, seconds, value, move in self.iterations:
+            print("iteration", depth, nodes, round(seconds, 6), value)
+        return True
+
+    def solve_position(self, deadline=None):
+        """(winner, winning move or None) for the current position, or None if time runs out"""
+        if deadline is None:
+            deadline = Deadline(self.timelimit)
         # Save state
-        original_board = [row[:] for row in self.board]
-        original_to_play = self.to_play
+        original_state = self.save_state()
         
+        start = time.monotonic()
+        self.last_iteration = None
+        self.solve_source = "book"
+        self.remote_search = None
         try:
-            signal.signal(signal.SIGALRM, handler)
-            signal.alarm(self.timelimit)
-            
-            winner, winning_move = self.solver_implementation()
-            
-            # Output format: "winner" or "winner x y"
-            if winning_move is not None:
-                print(f"{winner} {winning_move[0]} {winning_move[1]}")
-            else:
-                print(winner)
+            result = self.book_lookup()
+            if result is None:
+                self.solve_source = "tablebase"
+                result = self.tablebase_solve()
+            if result is None:
+                self.solve_source = "search"
+                self.search_depth = 0
+                if self.solver_mode == "mcts":
+                    # An estimate, not a proof, so it stays out of the book
+                    self.solve_source = "mcts"
+                    return self.mcts_implementation(deadline)
+                if self.solver_mode == "pns":
+                    result = self.pns_implementation(deadline)
+                elif self.worker_count > 1:
+                    self.remote_search = f"{self.worker_count} worker processes"
+                    result = self.parallel_implementation(deadline)
+                else:
+                    result = self.solver_implementation(deadline=deadline)
+                self.book_store(result[0], result[1], self.search_depth)
+            return result
                 
-        except (TimeoutException, TimeoutError):
-            print("unknown")
-        except Exception as e:
-            # Restore state on any exception
-            self.board = original_board
-            self.to_play = original_to_play
-            raise e
+        except TimeoutError:
+            self.solve_source = "timeout"
+            return None
         finally:
-            signal.alarm(0)
-            # Always restore original state
-            self.board = original_board
-            self.to_play = original_to_play
+            self.solve_time = time.monotonic() - start
+            # Always restore original state, keeping the undo stacks that play relies on
+            self.restore_state(original_state)
 
+    def save_state(self):
+        """Copy of everything make_move changes"""
+        return ([row[:] for row in self.board], self.to_play, self.p1_score, self.p2_score, self.score_deltas[:],
+                self.hashes[:], self.bits.masks[:], self.cells[:], self.empty_cells[:], self.empty_index[:],
+                self.empty_swaps[:])
+
+    def restore_state(self, state):
+        (self.board, self.to_play, self.p1_score, self.p2_score, self.score_deltas, self.hashes, self.bits.masks,
+         self.cells, self.empty_cells, self.empty_index, self.empty_swaps) = state
+
+    def solve_batch(self, args):
+        """solve_batch path: solve every position in a file, one JSON line per position"""
+        if len(args) < 1:
+            print("Expected arguments: path", file=sys.stderr)
+            return False
+        with open(args[0]) as f:
+            self.run_batch(f, sys.stdout)
         return True
 
+    def run_batch(self, lines, out):
+        """Each line is "w h p s board [timelimit]". Positions share the transposition table,
+        so grouping positions of the same game keeps it warm."""
+        default_timelimit = self.timelimit
+        for number, line in enumerate(lines, 1):
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            record = {"line": number, "position": " ".join(fields[:5])}
+            timelimit = default_timelimit
+            if len(fields) > 5:
+                try:
+                    timelimit = float(fields[5])
+                except ValueError:
+                    timelimit = None
+            if timelimit is None or not 0 < timelimit < float("inf"):
+                record["error"] = "invalid time limit"
+            elif len(fields) < 5 or not self.init_game(fields[:5]):
+                record["error"] = "invalid position"
+            else:
+                self.timelimit = timelimit
+                start = time.time()
+                result = self.solve_position()
+                record["winner"] = "unknown" if result is None else result[0]
+                record["move"] = None if result is None or result[1] is None else list(result[1])
+                record["time"] = round(time.time() - start, 4)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+        self.timelimit = default_timelimit
+
+
+# Interface kept by each server pool worker so its tables survive between requests
+pool_interface = None
+
+def pool_solve(position, end):
+    """Solve a position from CommandInterface.position in a pool worker process, returns (result, source).
+    end is the request's time.monotonic() deadline, which is system wide, so queueing time counts."""
+    global pool_interface
+    if pool_interface is None:
+        pool_interface = CommandInterface()
+    w, h, p, s, board_str, to_play, timelimit, solver_mode = position
+    pool_interface.init_game([str(w), str(h), str(p), str(s), board_str])
+    pool_interface.to_play = to_play
+    pool_interface.sync_state()
+    pool_interface.timelimit = timelimit
+    pool_interface.solver_mode = solver_mode
+    result = pool_interface.solve_position(Deadline(end - time.monotonic()))
+    return result, pool_interface.solve_source
+
+# Long-running commands that would stall every client of the server; run them offline instead
+SERVER_REFUSED_COMMANDS = ("tablebase", "solve_batch", "book_flush")
+
+class SolverServer:
+    """Speaks the stdin protocol over a socket, one CommandInterface per client.
+    solve runs in a process pool so one client's search does not block the others."""
+
+    def __init__(self, workers):
+        # Forked workers would inherit the listening and client sockets and hold connections open
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                           mp_context=multiprocessing.get_context("forkserver"))
+
+    async def handle(self, reader, writer):
+        interface = CommandInterface()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode().strip()
+                if line.split(" ")[0] == "exit":
+                    writer.write(b"= 1\n\n")
+                    break
+                writer.write((await self.run_command(interface, line)).encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def run_command(self, interface, line):
+        """Output and status line of one command, as main_loop would print them"""
+        output = io.StringIO()
+        command = line.lower().split(" ")[0]
+        if command in SERVER_REFUSED_COMMANDS:
+            print("? Command '" + command + "' is not available in server mode.", file=sys.stderr)
+            output.write("= -1\n\n")
+            return output.getvalue()
+        if command == "solve":
+            # The budget starts now, so time spent waiting for a free worker is not added to it
+            start = time.monotonic()
+            end = start + interface.timelimit
+            try:
+                # The worker's own deadline should expire first; this covers a stuck or busy pool
+                result, source = await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(self.pool, pool_solve, interface.position(), end),
+                    interface.timelimit + 1)
+            except asyncio.TimeoutError:
+                result, source = None, "timeout"
+            except Exception as e:
+                # Reported like process_command reports a failed command
+                print("Command '" + line + "' failed with exception:", file=sys.stderr)
+                print(e, file=sys.stderr)
+                output.write("= -1\n\n")
+                return output.getvalue()
+            # stats of this client can only report what the pool worker sent back
+            interface.solve_source = source
+            interface.solve_time = time.monotonic() - start
+            interface.remote_search = "a server pool worker"
+            with contextlib.redirect_stdout(output):
+                interface.print_solution(result)
+            ok = True
+        else:
+            with contextlib.redirect_stdout(output):
+                ok = interface.process_command(line)
+        if ok:
+            output.write("= 1\n\n")
+        return output.getvalue()
+
+    async def serve(self, address):
+        """address is host:port, or unix:path for a Unix socket"""
+        if address.startswith("unix:"):
+            server = await asyncio.start_unix_server(self.handle, path=address[5:])
+        else:
+            host, port = address.rsplit(":", 1)
+            server = await asyncio.start_server(self.handle, host, int(port))
+        async with server:
+            await server.serve_forever()
 
 if __name__ == "__main__":
     interface = CommandInterface()
-    interface.main_loop()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "--tablebase":
+        # Offline generation: python a2.py --tablebase w h p s [max_empty]
+        interface.init_game(sys.argv[2:6])
+        interface.tablebase_cmd(sys.argv[6:7])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # python a2.py --batch positions.txt, or - to read positions from stdin
+        if len(sys.argv) < 3 or sys.argv[2] == "-":
+            interface.run_batch(sys.stdin, sys.stdout)
+        else:
+            with open(sys.argv[2]) as f:
+                interface.run_batch(f, sys.stdout)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        # python a2.py --serve [host:port | unix:path] [workers]
+        address = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1:4555"
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        asyncio.run(SolverServer(workers).serve(address))
+    else:
+        interface.main_loop()
\ No newline at end of file
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+CMPUT 455 assignment 2 solver benchmark
+
+usage: python a2bench.py [-h] [-t TIMELIMIT] [-b BASELINE] [--save] [--tolerance TOLERANCE]
+                         [-v] your_submission [corpus]
+
+positional arguments:
+  your_submission        Path to your submissions .py file
+  corpus                 Positions to solve, one "w h p s board timelimit" per line
+                         (default: a2_bench_positions.txt next to this script)
+
+optional arguments:
+  -h, --help             show this help message and exit
+  -t, --timelimit        Override every position's time budget in seconds
+  -b, --baseline         JSON baseline to compare against (or write with --save)
+  --save                 Write this run to the baseline instead of comparing
+  --tolerance            Allowed slowdown per position as a fraction (default 0.25)
+  -v, --verbose          Print a line per position
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Sequence, Tuple, Union
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "a2_bench_positions.txt"
+
+# Slowdowns smaller than this many seconds are noise, whatever the ratio
+TIME_SLACK = 0.05
+
+# Color codes
+RED = "\033[31m"
+GREEN = "\033[32m"
+BLUE = "\033[34m"
+RESET = "\033[0m"
+
+def color_print(*args, color, **kwargs):
+    print(color, end="")
+    print(*args, **kwargs)
+    print(RESET, end="")
+
+@dataclass(frozen=True)
+class Position:
+    params: Tuple[str, str, str, str]
+    board: str
+    timelimit: float
+
+    @property
+    def name(self) -> str:
+        return " ".join(self.params + (self.board,))
+
+    @staticmethod
+    def from_corpus(corpus: Path) -> Tuple["Position", ...]:
+        positions = []
+        for line in corpus.read_text().split("\n"):
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            timelimit = float(fields[5]) if len(fields) > 5 else 1.0
+            positions.append(Position(tuple(fields[:4]), fields[4], timelimit))
+        return tuple(positions)
+
+@dataclass(frozen=True)
+class PositionResult:
+    name: str
+    answer: str
+    solved: bool
+    seconds: float
+    nodes: int
+
+    @property
+    def nodes_per_sec(self) -> float:
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+@dataclass(frozen=True)
+class BenchmarkRun:
+    results: Tuple[PositionResult, ...]
+    peak_memory_mb: float
+
+    @property
+    def solved_fraction(self) -> float:
+        return sum(result.solved for result in self.results) / len(self.results) if self.results else 0.0
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(result.seconds for result in self.results)
+
+    @property
+    def nodes_per_sec(self) -> float:
+        seconds = self.total_seconds
+        return sum(result.nodes for result in self.results) / seconds if seconds > 0 else 0.0
+
+    def summarize(self):
+        color_print("Benchmark report:", color=BLUE)
+        print(f"{len(self.results)} positions")
+        print(f"{sum(result.solved for result in self.results)} solved ({self.solved_fraction:.1%}), "
+              f"{sum(not result.solved for result in self.results)} unknown")
+        print(f"{self.total_seconds:.3f} seconds solving")
+        print(f"{self.nodes_per_sec:.0f} nodes/sec")
+        print(f"{self.peak_memory_mb:.1f} MB peak memory")
+
+    def to_json(self) -> Dict:
+        return {
+            "solved_fraction": self.solved_fraction,
+            "total_seconds": self.total_seconds,
+            "nodes_per_sec": self.nodes_per_sec,
+            "peak_memory_mb": self.peak_memory_mb,
+            "positions": [asdict(result) for result in self.results],
+        }
+
+def load_submission(submission: Path):
+    spec = importlib.util.spec_from_file_location("a2_submission", submission)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # Keep on-disk books and tablebases out of the timings so runs are reproducible
+    empty_dir = tempfile.mkdtemp()
+    module.BOOK_PATH = os.path.join(empty_dir, "book.bin")
+    module.TABLEBASE_DIR = empty_dir
+    return module
+
+def run_position(module, position: Position, timelimit: Union[float, None]) -> PositionResult:
+    # A fresh interface per position, so no position profits from the one before
+    interface = module.CommandInterface()
+    if not interface.init_game(list(position.params) + [position.board]):
+        raise ValueError(f"invalid position '{position.name}'")
+    budget = timelimit if timelimit is not None else position.timelimit
+    interface.timelimit = budget
+    start = time.perf_counter()
+    result = interface.solve_position(module.Deadline(budget))
+    seconds = time.perf_counter() - start
+    if result is None:
+        answer = "unknown"
+    elif result[1] is None:
+        answer = str(result[0])
+    else:
+        answer = f"{result[0]} {result[1][0]} {result[1][1]}"
+    return PositionResult(position.name, answer, result is not None, seconds, interface.nodes)
+
+def run_benchmark(submission: Path, corpus: Path, timelimit: Union[float, None], verbose: bool) -> BenchmarkRun:
+    module = load_submission(submission)
+    results = []
+    for position in Position.from_corpus(corpus):
+        result = run_position(module, position, timelimit)
+        if verbose:
+            print(f"{result.seconds:8.3f}s {result.nodes_per_sec:10.0f} n/s  {result.answer:8}  {result.name}")
+        results.append(result)
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return BenchmarkRun(tuple(results), peak)
+
+def compare_to_baseline(run: BenchmarkRun, baseline: Dict, tolerance: float) -> Sequence[str]:
+    """Every way this run is worse than the baseline"""
+    regressions = []
+    if run.solved_fraction < baseline["solved_fraction"]:
+        regressions.append(f"solved fraction fell from {baseline['solved_fraction']:.1%} to {run.solved_fraction:.1%}")
+    old_results = {result["name"]: result for result in baseline["positions"]}
+    for result in run.results:
+        old = old_results.get(result.name)
+        if old is None:
+            continue
+        if old["solved"] and not result.solved:
+            regressions.append(f"no longer solved: {result.name}")
+        elif old["solved"] and result.answer.split()[0] != old["answer"].split()[0]:
+            # Only the winner is compared: a position can have several winning moves
+            regressions.append(f"winner changed from '{old['answer']}' to '{result.answer}': {result.name}")
+        elif result.seconds > old["seconds"] * (1 + tolerance) + TIME_SLACK:
+            regressions.append(f"{old['seconds']:.3f}s -> {result.seconds:.3f}s: {result.name}")
+    return regressions
+
+@dataclass(frozen=True)
+class Invocation:
+    submission: Path
+    corpus: Path
+    timelimit: Union[float, None]
+    baseline: Union[Path, None]
+    save: bool
+    tolerance: float
+    verbose: bool
+
+    @staticmethod
+    def from_args() -> "Invocation":
+        parser = argparse.ArgumentParser(prog=f"python {sys.argv[0]}")
+        parser.add_argument("your_submission", help="Path to your submissions .py file")
+        parser.add_argument("corpus", nargs="?", default=str(DEFAULT_CORPUS), help="Path to the positions .txt file")
+        parser.add_argument("-t", "--timelimit", type=float, help="Override every position's time budget in seconds")
+        parser.add_argument("-b", "--baseline", help="JSON baseline to compare against (or write with --save)")
+        parser.add_argument("--save", action="store_true", help="Write this run to the baseline instead of comparing")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown per position as a fraction")
+        parser.add_argument("-v", "--verbose", action="store_true", help="Print a line per position")
+        args = parser.parse_args()
+        baseline = Path(args.baseline) if args.baseline is not None else None
+        inv = Invocation(Path(args.your_submission), Path(args.corpus), args.timelimit,
+                         baseline, args.save, args.tolerance, args.verbose)
+        assert inv.submission.exists(), f"invalid file path '{args.your_submission}'"
+        assert inv.corpus.exists(), f"invalid file path '{args.corpus}'"
+        assert not inv.save or inv.baseline is not None, "--save needs a --baseline path"
+        return inv
+
+def main():
+    invocation = Invocation.from_args()
+    run = run_benchmark(invocation.submission, invocation.corpus, invocation.timelimit, invocation.verbose)
+    run.summarize()
+
+    if invocation.baseline is None:
+        return
+    if invocation.save:
+        invocation.baseline.write_text(json.dumps(run.to_json(), indent=2) + "\n")
+        print(f"Baseline written to {invocation.baseline}")
+        return
+    regressions = compare_to_baseline(run, json.loads(invocation.baseline.read_text()), invocation.tolerance)
+    if regressions:
+        color_print(f"{len(regressions)} regressions against {invocation.baseline}:", color=RED)
+        for regression in regressions:
+            color_print(regression, color=RED)
+        sys.exit(1)
+    color_print(f"No regressions against {invocation.baseline}", color=GREEN)
+
+
+if __name__ == "__main__" and not sys.flags.interactive:
+    main()
@@ -3,7 +3,7 @@
 """
 CMPUT 455 assignment 2 testing script
 
-usage: python a2test.py [-h] [-v] your_submission test
+usage: python a2test.py [-h] [-v] [-j JOBS] your_submission test
 
 positional arguments:
   your_submission  Path to your submissions .py file
@@ -12,6 +12,7 @@ positional arguments:
 optional arguments:
   -h, --help       show this help message and exit
   -v, --verbose    Print more output
+  -j, --jobs       Number of games to run at once (default: number of CPUs)
 """
 
 import argparse
@@ -40,6 +41,9 @@ DEFAULT_TIMEOUT = 1
 USE_COLOR = True
 STATUS_PATTERN = re.compile(r"^= .*")
 
+# Commands whose effect outlasts init_game, replayed when games run in separate programs
+SETTING_COMMANDS = ("timelimit", "solver", "ttsize", "workers", "backend", "ponder", "trace")
+
 # Color codes
 RED = "\033[31m"
 GREEN = "\033[32m"
@@ -66,9 +70,12 @@ def timed(fn: Callable[[], T], timeout: float) -> Tuple[bool, T]:
 class StudentProgram:
     __path: Path
     __process: Union[Popen, None] = None
+    solve_timelimit: float
 
-    def __init__(self, submission: Path):
+    def __init__(self, submission: Path, solve_timelimit: float = CURRENT_SOLVE_TIMELIMIT):
         self.__path = submission
+        # Each program tracks its own limit, so several can run side by side
+        self.solve_timelimit = solve_timelimit
 
     def kill(self):
         if self.__process is not None:
@@ -90,15 +97,9 @@ class StudentProgram:
             timeout_secs = DEFAULT_TIMEOUT
         
         # If this command is `timelimit N`, remember it for the *next* solve
-        if test.command.startswith("timelimit"):
-            try:
-                _, n = test.command.split()
-                n = int(n)
-                # update the global *at runtime* for subsequent solves
-                global CURRENT_SOLVE_TIMELIMIT
-                CURRENT_SOLVE_TIMELIMIT = n
-            except Exception:
-                pass
+        n = parse_timelimit(test.command)
+        if n is not None:
+            self.solve_timelimit = n
 
         # If this specific test line sets a per-command timeout (your current behavior), use it.
         if test.dynamic_timeout is not None:
@@ -109,7 +110,7 @@ class StudentProgram:
 
         # if this is a solve command, add the *current* timelimit set earlier
         if test.command.split()[0] == "solve":
-            timeout_secs += CURRENT_SOLVE_TIMELIMIT
+            timeout_secs += self.solve_timelimit
 
         ok, result = timed(partial(self.run_command, test.command), timeout_secs)
         if ok:
@@ -139,6 +140,7 @@ class Invocation:
     submission: Path
     test: Path
     verbose: bool
+    jobs: int
 
     @staticmethod
     def from_args() -> "Invocation":
@@ -146,12 +148,22 @@ class Invocation:
         parser.add_argument("your_submission", help="Path to your submissions .py file")
         parser.add_argument("test", help="Path to the tests .txt file")
         parser.add_argument("-v", "--verbose", action="store_true", help="Print more output")
+        parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of games to run at once")
         args = parser.parse_args()
-        inv = Invocation(Path(args.your_submission), Path(args.test), args.verbose)
+        inv = Invocation(Path(args.your_submission), Path(args.test), args.verbose, max(1, args.jobs))
         assert inv.submission.exists(), f"invalid file path '{args.your_submission}'"
         assert inv.test.exists(), f"invalid file path '{args.test}'"
         return inv
 
+def parse_timelimit(command: str) -> Union[float, None]:
+    try:
+        name, n = command.split()
+        if name == "timelimit":
+            return float(n)
+    except ValueError:
+        pass
+    return None
+
 def iterlines(file: IO):
     while True:
         yield file.readline()
@@ -400,11 +412,47 @@ class FullTestRun:
     results_marked: TestResult
     stats_marked: TestStatistics
 
-def test_submission(submission: Path, test: Path) -> FullTestRun:
-    answer_key = Test.from_test_file(test)
+def split_games(tests: Sequence[Test]) -> Tuple[Tuple[Tuple[str, ...], Tuple[Test, ...]], ...]:
+    """Split the tests into independent games, each starting at an init_game, paired with
+    the setting commands a single program would have had in force at the start of the game"""
+    games = []
+    game = []
+    settings = {}
+    start_settings = ()
+    for test in tests:
+        name = test.command.split()[0]
+        if name == "init_game" and game:
+            games.append((start_settings, tuple(game)))
+            game = []
+            start_settings = tuple(settings.values())
+        game.append(test)
+        if name in SETTING_COMMANDS:
+            # Only the latest value of each setting matters
+            settings.pop(name, None)
+            settings[name] = test.command
+    if game:
+        games.append((start_settings, tuple(game)))
+    return tuple(games)
+
+def run_game(submission: Path, settings: Sequence[str], tests: Sequence[Test]) -> Tuple[Test, ...]:
     program = StudentProgram(submission)
-    stu_tests = tuple(program.run_test(test, DEFAULT_TIMEOUT)
-                for test in answer_key)
+    for command in settings:
+        # Carry over what earlier games set, without marking the commands
+        program.run_test(Test(command, "", False, None, ""))
+    stu_tests = tuple(program.run_test(test, DEFAULT_TIMEOUT) for test in tests)
+    program.kill()
+    return stu_tests
+
+def test_submission(submission: Path, test: Path, jobs: int) -> FullTestRun:
+    answer_key = Test.from_test_file(test)
+    if jobs == 1:
+        # One program for the whole file saves starting a new one per game
+        stu_tests = run_game(submission, (), answer_key)
+    else:
+        # Games share no state, so each gets its own program and they run side by side
+        with ThreadPool(processes=jobs) as pool:
+            game_tests = pool.starmap(partial(run_game, submission), split_games(answer_key))
+        stu_tests = tuple(chain.from_iterable(game_tests))
     results_all = TestResult.from_comparisons(answer_key, stu_tests)
     stats_all = TestStatistics.from_test_results(results_all)
 
@@ -414,15 +462,13 @@ def test_submission(submission: Path, test: Path) -> FullTestRun:
     results_for_marks = TestResult.from_comparisons(answer_key_for_marks, student_for_marks)
     stats_for_marks = TestStatistics.from_test_results(results_for_marks)
 
-    program.kill()
-
     return FullTestRun(results_all, stats_all, results_for_marks, stats_for_marks)
     
 
 def main():
     t0 = time.time()
     invocation = Invocation.from_args()
-    run_result = test_submission(invocation.submission, invocation.test)
+    run_result = test_submission(invocation.submission, invocation.test, invocation.jobs)
     print_detailed_results(run_result.results_all)
     run_result.stats_all.summarize()
     run_result.stats_marked.marks()